@@ -92,6 +92,7 @@ def main():
         "--include-package=uvicorn",
         "--include-package=PIL",
         "--include-package=jsonschema",
+        "--include-module=orjson",
         "--include-module=safehttpx",
         "--include-module=groovy",
         "--nofollow-import-to=*.tests",
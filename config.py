@@ -1,6 +1,6 @@
 import json
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, Optional, Tuple
 
 # 默认配置
 DEFAULT_CONFIG = {
@@ -8,15 +8,27 @@ DEFAULT_CONFIG = {
     "port": 8080,
     "model_dir": "./models",
     "debug": False,
-    "reload": False
+    "reload": False,
+    "tagging": {
+        "result_cache_size": 256,
+        "batch_window_ms": 5,
+        "max_batch_size": 16,
+        "concurrent_models": 1
+    }
 }
 
 CONFIG_FILE = "config.json"
 
-def load_config() -> Dict[str, Any]:
-    """
-    加载配置文件，如果不存在则创建默认配置文件
-    """
+# 扁平化的配置: {'tagging.result_cache_size': 256, ...}
+_flat: Optional[Dict[str, Any]] = None
+
+def _flatten(config: Dict[str, Any], prefix: str = '') -> Iterator[Tuple[str, Any]]:
+    for key, value in config.items():
+        yield f"{prefix}{key}", value
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}.")
+
+def _read_config(create: bool = True) -> Dict[str, Any]:
     if os.path.exists(CONFIG_FILE):
         try:
             with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
@@ -31,21 +43,43 @@ def load_config() -> Dict[str, Any]:
             return DEFAULT_CONFIG
     else:
         # 创建默认配置文件
-        save_config(DEFAULT_CONFIG)
+        if create:
+            save_config(DEFAULT_CONFIG)
         return DEFAULT_CONFIG
 
+def load_config() -> Dict[str, Any]:
+    """
+    加载配置文件，如果不存在则创建默认配置文件
+    """
+    global _flat
+    config = _read_config()
+    _flat = dict(_flatten(config))
+    return config
+
 def save_config(config: Dict[str, Any]) -> None:
     """
     保存配置到文件
     """
+    global _flat
     try:
         with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
             json.dump(config, f, indent=4, ensure_ascii=False)
     except Exception as e:
         print(f"保存配置文件时出错: {e}")
+    _flat = dict(_flatten(config))
+
+def get(key_path: str, default: Any = None) -> Any:
+    """
+    按点分路径读取配置项，例如 get('tagging.result_cache_size', 256)
+    """
+    global _flat
+    if _flat is None:
+        # 只读取，不创建配置文件
+        _flat = dict(_flatten(_read_config(create=False)))
+    return _flat.get(key_path, default)
 
 def get_config_file_path() -> str:
     """
     获取配置文件路径
     """
-    return os.path.abspath(CONFIG_FILE)
\ No newline at end of file
+    return os.path.abspath(CONFIG_FILE)
@@ -14,7 +14,13 @@ DEFAULT_CONFIG = {
     "port": 8080,
     "model_dir": "./models",
     "debug": False,
-    "reload": False
+    "reload": False,
+    "tagging": {
+        "result_cache_size": 256,
+        "batch_window_ms": 5,
+        "max_batch_size": 16,
+        "concurrent_models": 1
+    }
 }
 
 CONFIG_FILE = "config.json"
@@ -10,7 +10,7 @@ import base64
 from io import BytesIO
 
 from fastapi import FastAPI, HTTPException, Form, UploadFile, File
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
 from PIL import Image, ImageFile
@@ -18,17 +18,18 @@ from PIL import Image, ImageFile
 # Add current directory to Python path so we can import tagger modules
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+import config as app_config
 from tagger.api import Api
 from tagger import utils
-from tagger.interrogator import Interrogator
 from tagger import settings
 
 # Initialize PIL
 Image.init()
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
-# Create FastAPI app
-app = FastAPI(title="WD14 Tagger API", version="1.0.0")
+# Create FastAPI app; responses are serialized with orjson
+app = FastAPI(title="WD14 Tagger API", version="1.0.0",
+              default_response_class=ORJSONResponse)
 
 # Serve static files
 static_dir = Path(__file__).parent / "static"
@@ -67,7 +68,7 @@ async def root():
             <p><strong>GET</strong> <code>/tagger/v1/interrogators</code> - List available models</p>
             <p><strong>POST</strong> <code>/tagger/v1/interrogate</code> - Interrogate an image</p>
             <p><strong>POST</strong> <code>/tagger/v1/interrogate-categorized</code> - Interrogate an image with categorized tags</p>
-            <p><strong>POST</strong> <code>/tagger/v1/unload-interrogators</code> - Unload models from memory</p>
+            <p><strong>POST</strong> <code>/tagger/v1/unload-interrogators</code> - Shrink the memory of loaded models; with <code>?force=true</code>, unload them</p>
         </div>
 
         <div class="endpoint">
@@ -440,7 +441,14 @@ async def web_ui():
     return HTMLResponse(content=html_content, status_code=200)
 
 # Initialize the tagger API
-api = Api(app, None, prefix="/tagger/v1")
+api = Api(
+    app,
+    prefix="/tagger/v1",
+    result_cache_size=app_config.get('tagging.result_cache_size', 256),
+    batch_window_ms=app_config.get('tagging.batch_window_ms', 5),
+    max_batch_size=app_config.get('tagging.max_batch_size', 16),
+    concurrent_models=app_config.get('tagging.concurrent_models', 1),
+)
 
 # Custom exception handler
 @app.exception_handler(Exception)
@@ -450,6 +458,18 @@ async def general_exception_handler(request, exc):
         content={"detail": str(exc)}
     )
 
+# startup message, written at once rather than line by line
+BANNER = (
+    "Starting WD14 Tagger API on http://{host}:{port}\n"
+    "Available endpoints:\n"
+    "  GET  / - API documentation and usage examples\n"
+    "  GET  /ui - Web interface for image tagging\n"
+    "  POST /tagger/v1/interrogate - Interrogate an image\n"
+    "  POST /tagger/v1/interrogate-categorized - Interrogate an image with categorized tags\n"
+    "  GET  /tagger/v1/interrogators - List available models\n"
+    "  POST /tagger/v1/unload-interrogators - Shrink model memory (?force=true to unload)\n"
+)
+
 def refresh_models():
     """Refresh the list of available models"""
     try:
@@ -486,14 +506,8 @@ def main():
     refresh_models()
     
     # Run the API
-    print(f"Starting WD14 Tagger API on http://{args.host}:{args.port}")
-    print("Available endpoints:")
-    print("  GET  / - API documentation and usage examples")
-    print("  GET  /ui - Web interface for image tagging")
-    print("  POST /tagger/v1/interrogate - Interrogate an image")
-    print("  POST /tagger/v1/interrogate-categorized - Interrogate an image with categorized tags")
-    print("  GET  /tagger/v1/interrogators - List available models")
-    print("  POST /tagger/v1/unload-interrogators - Unload models from memory")
+    sys.stdout.write(BANNER.format(host=args.host, port=args.port))
+    sys.stdout.flush()
     
     uvicorn.run(
         "standalone:app" if not is_compiled else app,
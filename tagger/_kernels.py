@@ -0,0 +1,43 @@
+"""Kernels for the tag post-processing, JIT compiled if numba is present"""
+import numpy as np
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+
+def _filter_and_split_numpy(scores, categories, threshold):
+    """ indices of the scores above threshold, split into characters
+    (category 4) and the other tags """
+    mask = scores > threshold
+    is_char = categories == 4
+    return np.flatnonzero(mask & is_char), np.flatnonzero(mask & ~is_char)
+
+
+if HAS_NUMBA:
+    @njit(cache=True)
+    def _filter_and_split_jit(scores, categories, threshold):
+        """ single pass version of _filter_and_split_numpy """
+        n = scores.shape[0]
+        chars = np.empty(n, dtype=np.int64)
+        tags = np.empty(n, dtype=np.int64)
+        n_chars = 0
+        n_tags = 0
+        for i in range(n):
+            if scores[i] > threshold:
+                if categories[i] == 4:
+                    chars[n_chars] = i
+                    n_chars += 1
+                else:
+                    tags[n_tags] = i
+                    n_tags += 1
+        return chars[:n_chars], tags[:n_tags]
+
+    # compile at import, not on the first request
+    _filter_and_split_jit(np.zeros(1, dtype=np.float64),
+                          np.zeros(1, dtype=np.int8), 0.0)
+    filter_and_split = _filter_and_split_jit
+else:
+    filter_and_split = _filter_and_split_numpy
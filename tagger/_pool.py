@@ -0,0 +1,65 @@
+"""Reusable numpy buffers for the model input batches"""
+from collections import deque, OrderedDict
+from threading import Lock
+from typing import Deque, Tuple
+
+import numpy as np
+
+
+class TensorPool:
+    """ arrays kept for reuse, by shape and dtype; acquired arrays are not
+    zeroed. At most max_bytes stay pooled, the least recently used shapes
+    are evicted first """
+    def __init__(self, max_per_key: int = 4,
+                 max_bytes: int = 64 * 1024 * 1024) -> None:
+        self.max_per_key = max_per_key
+        self.max_bytes = max_bytes
+        self._free: 'OrderedDict[Tuple[Tuple[int, ...], str], Deque[np.ndarray]]' = \
+            OrderedDict()
+        self._bytes = 0
+        # the pool is shared by the worker threads
+        self._lock = Lock()
+
+    @property
+    def nbytes(self) -> int:
+        """ bytes held by the pooled arrays """
+        return self._bytes
+
+    def acquire(self, shape: Tuple[int, ...], dtype) -> np.ndarray:
+        """ a free array of shape and dtype, allocated if there is none """
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                array = free.pop()
+                self._bytes -= array.nbytes
+                if free:
+                    self._free.move_to_end(key)
+                else:
+                    del self._free[key]
+                return array
+        return np.empty(shape, dtype=dtype)
+
+    def release(self, array: np.ndarray) -> None:
+        """ hand an array back, it must not be used afterwards """
+        if array.nbytes > self.max_bytes:
+            return
+        key = (array.shape, array.dtype.str)
+        with self._lock:
+            free = self._free.setdefault(key, deque())
+            self._free.move_to_end(key)
+            if len(free) >= self.max_per_key:
+                return
+            free.append(array)
+            self._bytes += array.nbytes
+
+            while self._bytes > self.max_bytes:
+                oldest, free = next(iter(self._free.items()))
+                self._bytes -= free.popleft().nbytes
+                if not free:
+                    del self._free[oldest]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._free.clear()
+            self._bytes = 0
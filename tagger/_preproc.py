@@ -0,0 +1,108 @@
+"""Image preprocessing for the ONNX taggers, fused into one pass if numba is
+present"""
+from threading import Lock
+
+import numpy as np
+from PIL import Image
+
+from . import dbimutils  # pylint: disable=import-error # noqa
+
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+
+def _preprocess_numpy(image: Image.Image, height: int) -> np.ndarray:
+    # code for converting the image and running the model is taken from the
+    # link below. thanks, SmilingWolf!
+    # https://huggingface.co/spaces/SmilingWolf/wd-v1-4-tags/blob/main/app.py
+
+    # alpha to white
+    image = dbimutils.fill_transparent(image)
+
+    image = np.asarray(image)
+    # PIL RGB to OpenCV BGR, as a contiguous copy rather than a
+    # negative-stride view
+    image = np.ascontiguousarray(image[:, :, ::-1])
+
+    image = dbimutils.make_square(image, height)
+    return dbimutils.smart_resize(image, height)
+
+
+if HAS_NUMBA:
+    @njit(inline='always', cache=True)
+    def _pixel(rgba, y, x):
+        """ RGB of the image blended on white; white outside of the image """
+        if y < 0 or x < 0 or y >= rgba.shape[0] or x >= rgba.shape[1]:
+            return 255.0, 255.0, 255.0
+        alpha = rgba[y, x, 3] / 255.0
+        white = 255.0 * (1.0 - alpha)
+        return (rgba[y, x, 0] * alpha + white,
+                rgba[y, x, 1] * alpha + white,
+                rgba[y, x, 2] * alpha + white)
+
+    # nogil lets interrogate_stream preprocess while the model runs; the
+    # kernel itself is not reentrant, see _FUSED_LOCK
+    @njit(parallel=True, nogil=True, cache=True)
+    def _preprocess_fused(rgba, out):
+        """ alpha to white, pad to square, resize and RGB to BGR, writing
+        rounded uint8 straight into out """
+        height, width = rgba.shape[0], rgba.shape[1]
+        size = out.shape[0]
+        side = max(height, width, size)
+        top = (side - height) // 2
+        left = (side - width) // 2
+        scale = side / size
+
+        for y in prange(size):
+            for x in range(size):
+                r = 0.0
+                g = 0.0
+                b = 0.0
+                # average over the source area, like cv2.INTER_AREA; the
+                # square is never smaller than out, so this never upscales
+                y0 = y * scale
+                y1 = y0 + scale
+                x0 = x * scale
+                x1 = x0 + scale
+                for iy in range(int(y0), min(int(np.ceil(y1)), side)):
+                    wy = min(iy + 1.0, y1) - max(float(iy), y0)
+                    for ix in range(int(x0), min(int(np.ceil(x1)), side)):
+                        wx = min(ix + 1.0, x1) - max(float(ix), x0)
+                        pr, pg, pb = _pixel(rgba, iy - top, ix - left)
+                        r += pr * wy * wx
+                        g += pg * wy * wx
+                        b += pb * wy * wx
+                norm = scale * scale
+                out[y, x, 0] = np.uint8(min(b / norm + 0.5, 255.0))
+                out[y, x, 1] = np.uint8(min(g / norm + 0.5, 255.0))
+                out[y, x, 2] = np.uint8(min(r / norm + 0.5, 255.0))
+
+    # compile at import, not on the first request
+    _preprocess_fused(np.zeros((2, 1, 4), dtype=np.uint8),
+                      np.empty((1, 1, 3), dtype=np.uint8))
+
+
+# parallel kernels must not be entered from several threads at once: numba's
+# workqueue threading layer, used without TBB or OpenMP, aborts the process.
+# The kernel spreads over all cores already, so calls take turns
+_FUSED_LOCK = Lock()
+
+
+def preprocess(image: Image.Image, height: int, out=None) -> np.ndarray:
+    """ convert an image to a (height, height, 3) uint8 BGR array, written
+    into out if given """
+    if not HAS_NUMBA:
+        if out is None:
+            return _preprocess_numpy(image, height)
+        out[...] = _preprocess_numpy(image, height)
+        return out
+
+    rgba = np.asarray(image.convert('RGBA'))
+    if out is None:
+        out = np.empty((height, height, 3), dtype=np.uint8)
+    with _FUSED_LOCK:
+        _preprocess_fused(rgba, out)
+    return out
@@ -1,9 +1,11 @@
 """API module for FastAPI"""
-from typing import Callable, Dict, Optional, List
-from threading import Lock
+from typing import Callable, Dict, Optional, List, Tuple, Union
 from secrets import compare_digest
 import asyncio
-from collections import defaultdict
+import gc
+from collections import defaultdict, OrderedDict
+from itertools import chain
+from threading import Lock
 from hashlib import sha256
 import string
 from random import choices
@@ -11,14 +13,15 @@ import os
 
 # Standalone mode without Stable Diffusion
 shared = None
-queue_lock = Lock()
 HAS_SD = False
 
+import numpy as np
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 
 from tagger import utils  # pylint: disable=import-error
 from tagger import api_models as models  # pylint: disable=import-error
+from tagger import _kernels as kernels  # pylint: disable=import-error
 
 # For standalone operation
 try:
@@ -28,8 +31,8 @@ try:
 except ImportError:
     pass
 
-def decode_base64_to_image(encoding):
-    """Standalone version of decode_base64_to_image"""
+def decode_base64(encoding) -> bytes:
+    """Decode a base64 string or data URL to the raw image bytes"""
     if encoding is None:
         raise HTTPException(status_code=400, detail="Image data is None")
         
@@ -44,16 +47,34 @@ def decode_base64_to_image(encoding):
             raise HTTPException(status_code=400, detail="Invalid data URL format")
     
     try:
-        image = Image.open(BytesIO(base64.b64decode(encoding, validate=True)))
-        return image
+        return base64.b64decode(encoding, validate=True)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid encoded image: {str(e)}") from e
+
+
+def open_image(data: bytes):
+    """Open raw image bytes as a PIL image"""
+    try:
+        return Image.open(BytesIO(data))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid encoded image: {str(e)}") from e
 
 
+def decode_base64_to_image(encoding):
+    """Standalone version of decode_base64_to_image"""
+    return open_image(decode_base64(encoding))
+
+
 class Api:
     """Api class for FastAPI"""
     def __init__(
-        self, app: FastAPI, qlock: Lock, prefix: Optional[str] = None
+        self,
+        app: FastAPI,
+        prefix: Optional[str] = None,
+        result_cache_size: int = 256,
+        batch_window_ms: float = 5,
+        max_batch_size: int = 16,
+        concurrent_models: int = 1
     ) -> None:
         self.credentials = {}
         # In standalone mode, check for environment variables
@@ -67,8 +88,23 @@ class Api:
         self.queue: Dict[str, asyncio.Queue] = {}
         self.res: Dict[str, Dict[str, Dict[str, float]]] = \
             defaultdict(dict)
-        self.queue_lock = qlock if qlock else Lock()
         self.tasks: Dict[str, asyncio.Task] = {}
+        # (model, image sha256) -> (names, float32 scores), least recently
+        # used first; the names are shared by the entries of a model
+        self._result_cache: OrderedDict = OrderedDict()
+        self._result_names: Dict[str, Tuple[tuple, tuple]] = {}
+        self._result_cache_size = int(result_cache_size)
+        self._cache_lock = Lock()
+        # single images of concurrent requests are run together, collected
+        # per model for up to the batch window; a queue and its worker
+        # belong to the event loop they were made on
+        self._batch_queues: Dict[
+            asyncio.AbstractEventLoop,
+            Dict[str, Tuple[asyncio.Queue, asyncio.Task]]] = {}
+        self._batch_window = float(batch_window_ms) / 1000
+        self._max_batch_size = max(1, int(max_batch_size))
+        # the models split the cores between them, read when one loads
+        utils.concurrent_models = max(1, int(concurrent_models))
 
         self.runner: Optional[asyncio.Task] = None
         self.prefix = prefix
@@ -93,7 +129,10 @@ class Api:
             'interrogate-categorized',
             self.endpoint_interrogate_categorized,
             methods=['POST'],
-            response_model=models.TaggerInterrogateCategorizedResponse
+            response_model=Union[
+                models.TaggerInterrogateCategorizedResponse,
+                models.TaggerInterrogateColumnarResponse
+            ]
         )
 
         self.add_api_route(
@@ -137,7 +176,193 @@ class Api:
             # Without authentication
             self.app.add_api_route(path, endpoint, **kwargs)
 
-    def endpoint_interrogate(self, req: models.TaggerInterrogateRequest):
+    async def _run_inference(
+        self, model: str, images: List[object]
+    ) -> List[Tuple[Dict[str, float], Dict[str, float]]]:
+        """Interrogate images with one model run on the worker of the model,
+        so that a slow interrogation neither drains the default threadpool
+        nor holds up the other models. The interrogator is looked up once,
+        a refresh replacing it cannot pair its executor with another
+        instance."""
+        loop = asyncio.get_running_loop()
+        interrogator = utils.interrogators[model]
+        return await loop.run_in_executor(
+            interrogator.executor, interrogator.interrogate_batch, images)
+
+    @staticmethod
+    def _tag_categories(interrogator, tags: Dict[str, float]) -> np.ndarray:
+        """ category of each entry in tags (dict order), -1 if unknown """
+        categories = interrogator.tag_categories()
+        if categories is None or len(categories) != len(tags):
+            categories = np.full(len(tags), -1, dtype=np.int8)
+        return categories
+
+    async def _interrogate_many(
+        self, model: str, data: List[bytes]
+    ) -> List[Tuple[Dict[str, float], Dict[str, float]]]:
+        """ interrogate images given as bytes, memoized on the image
+        checksums; the uncached images go through the model as one batch """
+        keys = [(model, sha256(d).digest()) for d in data]
+        results = [None] * len(keys)
+        with self._cache_lock:
+            for i, key in enumerate(keys):
+                cached = self._result_cache.get(key)
+                if cached is not None:
+                    self._result_cache.move_to_end(key)
+                    results[i] = self._from_cache_entry(cached)
+
+        misses = [i for i, result in enumerate(results) if result is None]
+        if misses:
+            images = [open_image(data[i]) for i in misses]
+            if len(images) == 1 and self._max_batch_size > 1:
+                computed = [await self._interrogate_batched(model, images[0])]
+            else:
+                computed = await self._run_inference(model, images)
+
+            for i, result in zip(misses, computed):
+                results[i] = result
+
+            if self._result_cache_size > 0:
+                with self._cache_lock:
+                    for i, result in zip(misses, computed):
+                        self._result_cache[keys[i]] = \
+                            self._cache_entry(model, result)
+                    while len(self._result_cache) > self._result_cache_size:
+                        self._result_cache.popitem(last=False)
+        return results
+
+    def _cache_entry(
+        self, model: str, result: Tuple[Dict[str, float], Dict[str, float]]
+    ) -> Tuple[Tuple[tuple, tuple], np.ndarray]:
+        """ a result as its tag names and a float32 row of scores, a fraction
+        of the size of the dicts; call with _cache_lock held """
+        ratings, tags = result
+        names = (tuple(ratings), tuple(tags))
+        shared = self._result_names.get(model)
+        if shared == names:
+            names = shared
+        else:
+            self._result_names[model] = names
+        row = np.fromiter(chain(ratings.values(), tags.values()),
+                          dtype=np.float32, count=len(ratings) + len(tags))
+        return names, row
+
+    @staticmethod
+    def _from_cache_entry(
+        entry: Tuple[Tuple[tuple, tuple], np.ndarray]
+    ) -> Tuple[Dict[str, float], Dict[str, float]]:
+        """ the ratings and tags dicts of a cached result """
+        (rating_names, tag_names), row = entry
+        scores = row.tolist()
+        split = len(rating_names)
+        return (dict(zip(rating_names, scores[:split])),
+                dict(zip(tag_names, scores[split:])))
+
+    async def _interrogate_batched(
+        self, model: str, image
+    ) -> Tuple[Dict[str, float], Dict[str, float]]:
+        """ interrogate one image in a batch with the images of concurrent
+        requests for the same model """
+        loop = asyncio.get_running_loop()
+        if loop not in self._batch_queues:
+            # forget the workers of loops that are gone
+            for old in [x for x in self._batch_queues if x.is_closed()]:
+                del self._batch_queues[old]
+        workers = self._batch_queues.setdefault(loop, {})
+        if model in workers and not workers[model][1].done():
+            queue = workers[model][0]
+        else:
+            queue = asyncio.Queue()
+            # the handle is kept so the worker is not garbage collected
+            workers[model] = (
+                queue, loop.create_task(self._batch_worker(model, queue)))
+
+        future = loop.create_future()
+        await queue.put((image, future))
+        return await future
+
+    async def _batch_worker(self, model: str, queue: asyncio.Queue) -> None:
+        """ run the queued images of a model in batches of up to
+        max_batch_size, waiting the batch window for more to arrive """
+        while True:
+            batch = [await queue.get()]
+            if queue.qsize() + 1 < self._max_batch_size:
+                await asyncio.sleep(self._batch_window)
+            while len(batch) < self._max_batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            try:
+                results = await self._run_inference(
+                    model, [image for image, _ in batch])
+            except Exception:  # pylint: disable=broad-except
+                # retry one by one, so only the failing image errors
+                for image, future in batch:
+                    try:
+                        result, = await self._run_inference(model, [image])
+                    except Exception as err:  # pylint: disable=broad-except
+                        if not future.done():
+                            future.set_exception(err)
+                    else:
+                        if not future.done():
+                            future.set_result(result)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def _interrogate(
+        self, model: str, data: bytes
+    ) -> Tuple[Dict[str, float], Dict[str, float]]:
+        """ interrogate image bytes, memoized on the image checksum """
+        return (await self._interrogate_many(model, [data]))[0]
+
+    @staticmethod
+    def _tag_arrays(
+        tags: Dict[str, float]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """ tags as (names, scores) arrays """
+        names = np.array(list(tags), dtype=object)
+        scores = np.fromiter(tags.values(), dtype=np.float64, count=len(tags))
+        return names, scores
+
+    @classmethod
+    def _filter_and_split(
+        cls,
+        tags: Dict[str, float],
+        threshold: float,
+        categories: Optional[np.ndarray] = None
+    ) -> Tuple[Dict[str, float], Dict[str, float]]:
+        """ threshold the tags and split off characters (category 4) in one
+        pass; returns (characters, regular tags) """
+        names, scores = cls._tag_arrays(tags)
+        if categories is None:
+            categories = np.full(len(scores), -1, dtype=np.int8)
+        chars, rest = kernels.filter_and_split(scores, categories,
+                                               float(threshold))
+
+        return (dict(zip(names[chars].tolist(), scores[chars].tolist())),
+                dict(zip(names[rest].tolist(), scores[rest].tolist())))
+
+    @staticmethod
+    def _filter_and_split_batch(
+        names: np.ndarray,
+        scores: np.ndarray,
+        threshold: float,
+        categories: np.ndarray
+    ) -> List[Tuple[Dict[str, float], Dict[str, float]]]:
+        """ _filter_and_split for a (images, tags) score matrix; returns
+        (characters, regular tags) per image """
+        rows, cols = np.nonzero(scores > threshold)
+        is_char = (categories[cols] == 4).tolist()
+        split = [({}, {}) for _ in range(scores.shape[0])]
+
+        for row, name, score, char in zip(rows.tolist(), names[cols].tolist(),
+                                          scores[rows, cols].tolist(), is_char):
+            split[row][0 if char else 1][name] = score
+        return split
+
+    async def endpoint_interrogate(self, req: models.TaggerInterrogateRequest):
         """ one file interrogation, queueing, or batch results """
         if req.image is None:
             raise HTTPException(404, 'Image not found')
@@ -157,22 +382,18 @@ class Api:
                     if q not in self.queue:
                         break
                 print(f'WD14 tagger api generated queue name: {q}')
-            res = asyncio.run(self.queue_interrogation(m, q, n, req.image,
-                              req.threshold), debug=True)
+            res = await self.queue_interrogation(m, q, n, req.image,
+                                                 req.threshold)
         else:
-            image = decode_base64_to_image(req.image)
-            interrogator = utils.interrogators[m]
             res = {"tag": {}, "rating": {}}
-            with self.queue_lock:
-                res["rating"], tag = interrogator.interrogate(image)
+            res["rating"], tag = await self._interrogate(
+                m, decode_base64(req.image))
 
-            for k, v in tag.items():
-                if v > req.threshold:
-                    res["tag"][k] = v
+            _, res["tag"] = self._filter_and_split(tag, req.threshold)
 
-        return models.TaggerInterrogateResponse(caption=res)
+        return {"caption": res}
 
-    def endpoint_interrogate_batch(self, req: models.TaggerInterrogateBatchRequest):
+    async def endpoint_interrogate_batch(self, req: models.TaggerInterrogateBatchRequest):
         """ batch interrogation of multiple images with categorized results """
         if not req.images:
             raise HTTPException(400, 'No images provided')
@@ -181,129 +402,102 @@ class Api:
             raise HTTPException(404, 'Model not found')
 
         interrogator = utils.interrogators[req.model]
-        
-        # Load tags database for the model to get category information
-        tags_df = None
-        if hasattr(interrogator, 'tags') and interrogator.tags is not None:
-            tags_df = interrogator.tags
-        else:
-            # Load the tags file if not already loaded
-            if req.images:
-                image = decode_base64_to_image(req.images[0])
-                with self.queue_lock:
-                    interrogator.load()
-                    # We don't actually need to interrogate here, just load the model
-                    # to access the tags data
-                    _, _ = interrogator.interrogate(image)
-                tags_df = interrogator.tags
-
-        # Create a mapping from tag name to category if tags data is available
-        tag_categories = {}
-        if tags_df is not None and 'name' in tags_df.columns and 'category' in tags_df.columns:
-            for _, row in tags_df.iterrows():
-                tag_categories[row['name']] = row['category']
-
-        images = [decode_base64_to_image(img) for img in req.images]
-        results: List[Dict[str, Dict[str, float]]] = []
-
-        # Process images
-        with self.queue_lock:
-            for img in req.images:
-                try:
-                    image = decode_base64_to_image(img)
-                except Exception as e:
-                    raise HTTPException(status_code=400, detail=f"Invalid encoded image: {str(e)}") from e
-                    
-                ratings, tags = interrogator.interrogate(image)
-                
-                # Filter tags by threshold
-                filtered_tags = {k: v for k, v in tags.items() if v > req.threshold}
-
-                # Categorize tags
-                characters = {}
-                regular_tags = {}
-                
-                for tag, confidence in filtered_tags.items():
-                    category = tag_categories.get(tag, -1)  # Default to -1 if not found
-                    if category == 4:
-                        characters[tag] = confidence
-                    else:
-                        regular_tags[tag] = confidence
-
-                # Format result in categorized structure
-                result = {
-                    "ratings": ratings,
-                    "characters": characters,
-                    "tags": regular_tags
-                }
-                results.append(result)
-
-        return models.TaggerInterrogateBatchResponse(captions=results)
-
-    def endpoint_interrogate_categorized(self, req: models.TaggerInterrogateRequest):
-        """ one file interrogation with categorized tags """
+        data = [decode_base64(img) for img in req.images]
+        interrogations = await self._interrogate_many(req.model, data)
+
+        # all images share the tag order of the model, so the scores stack
+        # into one (images, tags) matrix that is filtered in one go
+        first_tags = interrogations[0][1]
+        names, _ = self._tag_arrays(first_tags)
+        scores = np.array([
+            np.fromiter(tags.values(), dtype=np.float64, count=len(tags))
+            for _, tags in interrogations
+        ]).reshape(len(interrogations), len(names))
+
+        # the model is loaded now, so the category information is too
+        categories = self._tag_categories(interrogator, first_tags)
+        split = self._filter_and_split_batch(names, scores, req.threshold,
+                                             categories)
+
+        # Format results in categorized structure
+        results: List[Dict[str, Dict[str, float]]] = [
+            {
+                "ratings": ratings,
+                "characters": characters,
+                "tags": regular_tags
+            }
+            for (ratings, _), (characters, regular_tags)
+            in zip(interrogations, split)
+        ]
+
+        return {"captions": results}
+
+    async def endpoint_interrogate_categorized(
+        self, req: models.TaggerInterrogateRequest, columnar: bool = False
+    ):
+        """ one file interrogation with categorized tags; with columnar,
+        the tags above threshold are returned as parallel lists """
         if req.image is None:
             raise HTTPException(404, 'Image not found')
 
         if req.model not in utils.interrogators:
             raise HTTPException(404, 'Model not found')
 
-        # Load tags database for the model to get category information
         interrogator = utils.interrogators[req.model]
-        if hasattr(interrogator, 'tags') and interrogator.tags is not None:
-            tags_df = interrogator.tags
-        else:
-            # Load the tags file if not already loaded
-            image = decode_base64_to_image(req.image)
-            with self.queue_lock:
-                interrogator.load()
-                # We don't actually need to interrogate here, just load the model
-                # to access the tags data
-                _, _ = interrogator.interrogate(image)
-            tags_df = interrogator.tags
-
-        # Create a mapping from tag name to category
-        tag_categories = {}
-        if 'name' in tags_df.columns and 'category' in tags_df.columns:
-            for _, row in tags_df.iterrows():
-                tag_categories[row['name']] = row['category']
-
-        image = decode_base64_to_image(req.image)
-        with self.queue_lock:
-            ratings, tags = interrogator.interrogate(image)
-
-        # Filter tags by threshold
-        filtered_tags = {k: v for k, v in tags.items() if v > req.threshold}
-
-        # Categorize tags
-        characters = {}
-        regular_tags = {}
-        
-        for tag, confidence in filtered_tags.items():
-            category = tag_categories.get(tag, -1)  # Default to -1 if not found
-            if category == 4:
-                characters[tag] = confidence
-            else:
-                regular_tags[tag] = confidence
-
-        return models.TaggerInterrogateCategorizedResponse(
-            ratings=ratings,
-            characters=characters,
-            tags=regular_tags
-        )
+        ratings, tags = await self._interrogate(req.model,
+                                                decode_base64(req.image))
+
+        # the model is loaded now, so the category information is too
+        categories = self._tag_categories(interrogator, tags)
+        if columnar:
+            names, scores = self._tag_arrays(tags)
+            mask = scores > req.threshold
+            return {
+                "ratings": ratings,
+                "names": names[mask].tolist(),
+                "categories": categories[mask].tolist(),
+                "confidences": scores[mask].tolist()
+            }
+
+        characters, regular_tags = self._filter_and_split(
+            tags, req.threshold, categories)
+
+        return {
+            "ratings": ratings,
+            "characters": characters,
+            "tags": regular_tags
+        }
 
     def endpoint_interrogators(self):
         # Refresh interrogators in case new models were added
         utils.refresh_interrogators()
-        return models.TaggerInterrogatorsResponse(
-            models=list(utils.interrogators.keys())
-        )
+        return {"models": list(utils.interrogators.keys())}
+
+    def endpoint_unload_interrogators(self, force: bool = False):
+        """ shrink the memory arenas of the loaded models, keeping them
+        loaded; with force, unload them and drop their sessions """
+        if not force:
+            # on the worker of each model, so no run is using its buffers
+            shrunk_models = sum(
+                1 for i in utils.interrogators.loaded()
+                if i.executor.submit(i.shrink).result())
+            return f"Successfully shrunk {shrunk_models} model(s)"
 
-    def endpoint_unload_interrogators(self):
         unloaded_models = 0
 
-        for i in utils.interrogators.values():
-            if i.unload():
+        for i in utils.interrogators.loaded():
+            # on the worker of the model, not while a run is using it
+            if i.executor.submit(i.unload).result():
                 unloaded_models = unloaded_models + 1
 
+        # the cached results would outlive the models otherwise
+        with self._cache_lock:
+            self._result_cache.clear()
+            self._result_names.clear()
+
+        # the sessions are cached beyond unload, release them for real
+        from tagger.interrogator import Interrogator  # pylint: disable=E0401
+        Interrogator.purge_sessions()
+        gc.collect()
+
         return f"Successfully unload {unloaded_models} model(s)"
\ No newline at end of file
@@ -82,6 +82,26 @@ class TaggerInterrogateCategorizedResponse(BaseModel):
     )
 
 
+class TaggerInterrogateColumnarResponse(BaseModel):
+    """Interrogate response model with tags as parallel lists"""
+    ratings: Dict[str, float] = Field(
+        title='Ratings',
+        description='Rating tags (general, sensitive, questionable, explicit)'
+    )
+    names: List[str] = Field(
+        title='Names',
+        description='Names of the tags above the threshold'
+    )
+    categories: List[int] = Field(
+        title='Categories',
+        description='Category of each tag (4 for characters, -1 if unknown)'
+    )
+    confidences: List[float] = Field(
+        title='Confidences',
+        description='Confidence of each tag'
+    )
+
+
 class TaggerInterrogatorsResponse(BaseModel):
     """Interrogators response model"""
     models: List[str] = Field(
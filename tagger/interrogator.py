@@ -2,13 +2,17 @@
 import os
 from pathlib import Path
 import io
+import csv
 import json
 import inspect
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from platform import uname
-from typing import Tuple, List, Dict, Callable
-from pandas import read_csv
+from typing import Tuple, List, Dict, Callable, Iterable, Iterator
 from PIL import Image, UnidentifiedImageError
-from numpy import asarray, float32, expand_dims, exp
+from numpy import array, asarray, copyto, float32, int8, uint8, pad, exp, \
+                  zeros
 from tqdm import tqdm
 
 try:
@@ -18,6 +22,12 @@ except ImportError:
     HAS_HUGGINGFACE = False
     hf_hub_download = None
 
+try:
+    from huggingface_hub import try_to_load_from_cache
+except ImportError:
+    # huggingface_hub < 0.10, always go through hf_hub_download
+    try_to_load_from_cache = None
+
 # Standalone mode settings
 extensions_dir = os.path.dirname(os.path.abspath(__file__))
 shared = type('Shared', (), {})()
@@ -32,8 +42,10 @@ shared.opts.tagger_hf_cache_dir = os.path.join(os.getcwd(), "cache")
 HAS_SD = False
 
 from tagger import settings  # pylint: disable=import-error
+from tagger import utils  # pylint: disable=import-error
 from tagger.uiset import QData, IOData  # pylint: disable=import-error
-from . import dbimutils  # pylint: disable=import-error # noqa
+from . import _preproc  # pylint: disable=import-error # noqa
+from ._pool import TensorPool  # pylint: disable=import-error # noqa
 
 Its = settings.InterrogatorSettings
 
@@ -43,7 +55,22 @@ use_cpu = ('all' in shared.cmd_opts.use_cpu) or (
 
 # https://onnxruntime.ai/docs/execution-providers/
 # https://github.com/toriato/stable-diffusion-webui-wd14-tagger/commit/e4ec460122cf674bbf984df30cdb10b4370c1224#r92654958
-onnxrt_providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+# EXHAUSTIVE conv algo search autotunes once per input shape, i.e. per batch
+# size; the micro-batcher keeps those to 1..tagging.max_batch_size. NHWC
+# convolutions match the layout of the WD14 exports and of the tensor cores.
+# The CPU provider stays listed for ops CUDA does not support
+ONNX_DEVICE_ID = 0
+onnxrt_providers = [
+    ('CUDAExecutionProvider', {
+        'device_id': ONNX_DEVICE_ID,
+        'cudnn_conv_algo_search': 'EXHAUSTIVE',
+        'cudnn_conv_use_max_workspace': True,
+        'prefer_nhwc': True,
+        'do_copy_in_default_stream': True,
+        'arena_extend_strategy': 'kNextPowerOfTwo',
+    }),
+    'CPUExecutionProvider'
+]
 
 if shared and shared.cmd_opts and shared.cmd_opts.additional_device_ids is not None:
     from re import match as re_match
@@ -52,6 +79,9 @@ if shared and shared.cmd_opts and shared.cmd_opts.additional_device_ids is not N
         raise ValueError('--device-id is not cpu:<nr> or gpu:<nr>')
     if m.group(1) == 'c':
         onnxrt_providers.pop(0)
+    else:
+        ONNX_DEVICE_ID = int(shared.cmd_opts.additional_device_ids[4:])
+        onnxrt_providers[0][1]['device_id'] = ONNX_DEVICE_ID
     TF_DEVICE_NAME = f'/{shared.cmd_opts.additional_device_ids}'
 elif use_cpu:
     TF_DEVICE_NAME = '/cpu:0'
@@ -61,6 +91,34 @@ else:
 
 print(f'== WD14 tagger {TF_DEVICE_NAME}, {uname()} ==')
 
+# model input batches, shared by the interrogators and their workers
+_TENSOR_POOL = TensorPool()
+
+# onnx sessions by (model path, provider names), shared by the interrogators
+# and kept on unload; see Interrogator.purge_sessions()
+_SESSION_CACHE: Dict[Tuple[str, Tuple[str, ...]], object] = {}
+
+
+_ENV_ALLOCATOR_REGISTERED = False
+
+
+def _register_env_allocator(ort) -> bool:
+    """ register a shared CPU arena allocator with the onnxruntime
+    environment, once; returns whether sessions can use it """
+    global _ENV_ALLOCATOR_REGISTERED  # pylint: disable=global-statement
+    if not _ENV_ALLOCATOR_REGISTERED:
+        try:
+            memory_info = ort.OrtMemoryInfo(
+                'Cpu', ort.OrtAllocatorType.ORT_ARENA_ALLOCATOR, 0,
+                ort.OrtMemType.DEFAULT)
+            ort.create_and_register_allocator(memory_info,
+                                              ort.OrtArenaCfg(0, -1, -1, -1))
+            _ENV_ALLOCATOR_REGISTERED = True
+        except (AttributeError, RuntimeError) as err:
+            # older onnxruntime, or an allocator registered elsewhere
+            print(f'Shared onnxruntime allocator not registered: {err}')
+    return _ENV_ALLOCATOR_REGISTERED
+
 
 def get_onnxrt():
     """Get ONNX runtime module with error handling for standalone mode"""
@@ -116,6 +174,16 @@ class Interrogator:
     }
     output = None
     odd_increment = 0
+    # update methods per input key, resolved once rather than on every event
+    _SETTERS: Dict[str, Callable[[str], None]] = {
+        'output_dir': IOData.update_output_dir,
+        'keep': QData.update_keep,
+        'exclude': QData.update_exclude,
+        'add': QData.update_add,
+        'search': QData.update_search,
+        'replace': QData.update_replace,
+    }
+    _SETTER_CLOSURES: Dict[str, Callable[[str], Tuple[str, str]]] = {}
 
     @classmethod
     def flip(cls, key):
@@ -136,16 +204,24 @@ class Interrogator:
 
     @classmethod
     def set(cls, key: str) -> Callable[[str], Tuple[str, str]]:
-        def setter(val) -> Tuple[str, str]:
-            if key == 'input_glob':
+        setter = cls._SETTER_CLOSURES.get(key)
+        if setter is not None:
+            return setter
+
+        if key == 'input_glob':
+            def setter(val) -> Tuple[str, str]:
                 IOData.update_input_glob(val)
                 return (val, cls.get_errors())
-            if val != cls.input[key]:
-                tgt_cls = IOData if key == 'output_dir' else QData
-                getattr(tgt_cls, "update_" + key)(val)
-                cls.input[key] = val
-            return (cls.input[key], cls.get_errors())
+        else:
+            update = cls._SETTERS[key]
+
+            def setter(val) -> Tuple[str, str]:
+                if val != cls.input[key]:
+                    update(val)
+                    cls.input[key] = val
+                return (cls.input[key], cls.get_errors())
 
+        cls._SETTER_CLOSURES[key] = setter
         return setter
 
     @staticmethod
@@ -162,10 +238,27 @@ class Interrogator:
     def __init__(self, name: str) -> None:
         self.name = name
         self.model = None
+        self._executor = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """ single worker for this model, so different models run side by
+        side while the runs of one model stay serialized """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f'tagger-{self.name}')
+        return self._executor
 
     def load(self) -> None:
         raise NotImplementedError()
 
+    @classmethod
+    def purge_sessions(cls) -> int:
+        """ drop the cached onnx sessions, returns how many there were """
+        purged = len(_SESSION_CACHE)
+        _SESSION_CACHE.clear()
+        return purged
+
     def unload(self) -> bool:
         unloaded = False
         if self.model is not None:
@@ -175,6 +268,11 @@ class Interrogator:
             print(f'Unloaded {self.name} model')
         return unloaded
 
+    def shrink(self) -> bool:
+        """ release cached memory while keeping the model loaded, returns
+        whether anything was released """
+        return False
+
     def interrogate(
         self,
         image: Image
@@ -184,19 +282,55 @@ class Interrogator:
     ]:
         raise NotImplementedError()
 
+    def interrogate_batch(
+        self,
+        images: List[Image]
+    ) -> List[Tuple[
+        Dict[str, float],  # rating confidents
+        Dict[str, float]  # tag confidents
+    ]]:
+        return [self.interrogate(image) for image in images]
+
+    def tag_categories(self):
+        """ category per tag, in the order of the tags returned by
+        interrogate(), or None if the model has no category information """
+        return None
+
 
 # brought from https://github.com/KichangKim/DeepDanbooru/blob/master/deepdanbooru/data/__init__.py
+_FC_TRANS = str.maketrans({c: ' ' for c in '"*/:<>?\\|+[]'})
+
+
 def replace_fc_to_blank(text: str) -> str:
     """
     Replace forbidden characters to blank character.
     """
-    if text is None:
-        return ''
+    return text.translate(_FC_TRANS) if text else ''
+
+
+# tensorflow and deepdanbooru are imported on the first DeepDanbooru load
+# only, as importing tensorflow takes seconds
+_DEEPDANBOORU_MODULES = None
+_TF_MEM_GROWTH_SET = False
+
+
+def _import_deepdanbooru():
+    """ (tensorflow, deepdanbooru.project), imported once """
+    global _DEEPDANBOORU_MODULES  # pylint: disable=global-statement
+    if _DEEPDANBOORU_MODULES is None:
+        # deepdanbooru package is not include in web-sd anymore
+        # https://github.com/AUTOMATIC1111/stable-diffusion-webui/commit/c81d440d876dfd2ab3560410f37442ef56fc663
+        try:
+            import deepdanbooru.project as ddp
+        except ImportError as err:
+            raise ImportError(
+                "Please install deepdanbooru to use DeepDanbooru models: "
+                "pip install git+https://github.com/KichangKim/DeepDanbooru.git"
+            ) from err
 
-    return text.translate(str.maketrans({
-        c: ' ' for c in
-        ['"', '*', '/', ':', '<', '>', '?', '\\', '|', '+', '[', ']']
-    }))
+        import tensorflow as tf
+        _DEEPDANBOORU_MODULES = (tf, ddp)
+    return _DEEPDANBOORU_MODULES
 
 
 class DeepDanbooruInterrogator(Interrogator):
@@ -210,30 +344,21 @@ class DeepDanbooruInterrogator(Interrogator):
     def load(self) -> None:
         print(f'Loading {self.name} from {str(self.project_path)}')
 
-        # deepdanbooru package is not include in web-sd anymore
-        # https://github.com/AUTOMATIC1111/stable-diffusion-webui/commit/c81d440d876dfd2ab3560410f37442ef56fc663
-        try:
-            import deepdanbooru
-        except ImportError:
-            raise ImportError(
-                "Please install deepdanbooru to use DeepDanbooru models: "
-                "pip install git+https://github.com/KichangKim/DeepDanbooru.git"
-            )
-
-        import tensorflow as tf
+        tf, ddp = _import_deepdanbooru()
 
-        # tensorflow maps nearly all vram by default, so we limit this
+        # tensorflow maps nearly all vram by default, so we limit this, once
+        # per process as tensorflow refuses to change it after the first use
         # https://www.tensorflow.org/guide/gpu#limiting_gpu_memory_growth
-        # TODO: only run on the first run
-        for device in tf.config.experimental.list_physical_devices('GPU'):
-            try:
-                tf.config.experimental.set_memory_growth(device, True)
-            except RuntimeError as err:
-                print(err)
+        global _TF_MEM_GROWTH_SET  # pylint: disable=global-statement
+        if not _TF_MEM_GROWTH_SET:
+            for device in tf.config.experimental.list_physical_devices('GPU'):
+                try:
+                    tf.config.experimental.set_memory_growth(device, True)
+                except RuntimeError as err:
+                    print(err)
+            _TF_MEM_GROWTH_SET = True
 
         with tf.device(TF_DEVICE_NAME):
-            import deepdanbooru.project as ddp
-
             self.model = ddp.load_model_from_project(
                 project_path=self.project_path,
                 compile_model=False
@@ -261,21 +386,25 @@ class DeepDanbooruInterrogator(Interrogator):
         if self.model is None:
             self.load()
 
-        import deepdanbooru.data as ddd
-
-        # convert an image to fit the model
-        image_bufs = io.BytesIO()
-        image.save(image_bufs, format='PNG')
-        image = ddd.load_image_for_evaluate(
-            image_bufs,
-            self.model.input_shape[2],
-            self.model.input_shape[1]
-        )
-
-        image = image.reshape((1, *image.shape[0:3]))
+        # convert an image to fit the model, as deepdanbooru's
+        # load_image_for_evaluate does but without a PNG round trip: area
+        # resize keeping the aspect ratio, then pad to size by edge values
+        height, width = self.model.input_shape[1:3]
+        image = image.convert('RGB')
+        scale = min(width / image.width, height / image.height)
+        size = (max(1, round(image.width * scale)),
+                max(1, round(image.height * scale)))
+        image = asarray(image.resize(size, Image.BOX), dtype=float32) / 255.0
+
+        pad_h = height - size[1]
+        pad_w = width - size[0]
+        image = pad(image, ((pad_h // 2, pad_h - pad_h // 2),
+                            (pad_w // 2, pad_w - pad_w // 2),
+                            (0, 0)), mode='edge')
+        image = image.reshape((1, height, width, 3))
 
         # evaluate model
-        result = self.model.predict(image)
+        result = self.model.predict(image, batch_size=1, verbose=0)
 
         confidences = result[0].tolist()
         ratings = {}
@@ -290,6 +419,46 @@ class DeepDanbooruInterrogator(Interrogator):
         return ratings, tags
 
 
+def _uint8_input_model(model_path: str) -> str:
+    """ path to a sibling model that takes uint8 pixels and casts them to
+    float on the device, or model_path if it cannot be made """
+    uint8_path = os.path.splitext(model_path)[0] + '.uint8in.onnx'
+    if os.path.isfile(uint8_path) and \
+            os.path.getmtime(uint8_path) >= os.path.getmtime(model_path):
+        return uint8_path
+
+    try:
+        import onnx
+        from onnx import helper, TensorProto
+    except ImportError:
+        return model_path
+
+    try:
+        model = onnx.load(model_path)
+        graph = model.graph
+        initializers = {i.name for i in graph.initializer}
+        model_input = next(i for i in graph.input if i.name not in initializers)
+        tensor_type = model_input.type.tensor_type
+        if tensor_type.elem_type != TensorProto.FLOAT:
+            return model_path
+
+        # WD14 models take 0-255 pixel values, so only a Cast is prepended
+        float_name = f'{model_input.name}_float'
+        for node in graph.node:
+            for i, name in enumerate(node.input):
+                if name == model_input.name:
+                    node.input[i] = float_name
+        graph.node.insert(0, helper.make_node(
+            'Cast', [model_input.name], [float_name], to=TensorProto.FLOAT))
+        tensor_type.elem_type = TensorProto.UINT8
+        onnx.save(model, uint8_path)
+    except Exception as err:  # pylint: disable=broad-except
+        print(f'Could not write uint8 input model {uint8_path}: {err}')
+        return model_path
+
+    return uint8_path
+
+
 class WaifuDiffusionInterrogator(Interrogator):
     """ WaifuDiffusion Interrogator class """
     def __init__(
@@ -304,13 +473,23 @@ class WaifuDiffusionInterrogator(Interrogator):
         self.repo_id = repo_id
         self.model_path = model_path
         self.tags_path = tags_path
-        self.tags = None
         self.model = None
-        self.tags = None
         self.local_model = None
         self.local_tags = None
         self.is_hf = is_hf
         self.model_type = "onnx"  # Default to ONNX
+        self._input_name = None
+        self._label_name = None
+        self._height = None
+        self._nchw = False
+        self._uint8_input = False
+        self._apply_sigmoid = None
+        self._io_binding = None
+        self._ort_input = None
+        self._tag_names = None
+        self._rating_names = None
+        self._general_names = None
+        self._general_categories = None
 
     def download(self) -> Tuple[str, str]:
         """Download model and tags from HuggingFace or use local files"""
@@ -334,17 +513,28 @@ class WaifuDiffusionInterrogator(Interrogator):
         print(f"Loading {self.name} model file from {self.repo_id}, "
               f"{self.model_path}")
 
-        model_path = hf_hub_download(
-            repo_id=self.repo_id,
-            filename=self.model_path,
-            cache_dir=cache)
-        tags_path = hf_hub_download(
-            repo_id=self.repo_id,
-            filename=self.tags_path,
-            cache_dir=cache)
-        
+        model_path = self._hf_file(self.model_path, cache)
+        tags_path = self._hf_file(self.tags_path, cache)
+
         return model_path, tags_path
 
+    def _hf_file(self, filename: str, cache: str) -> str:
+        """ cached file path without a network round trip when possible """
+        if try_to_load_from_cache is not None:
+            path = try_to_load_from_cache(repo_id=self.repo_id,
+                                          filename=filename,
+                                          cache_dir=cache)
+            # a miss is None, or a sentinel for files known not to exist
+            if isinstance(path, str):
+                return path
+
+        offline = os.environ.get('HF_HUB_OFFLINE', '').upper() in \
+            ('1', 'ON', 'YES', 'TRUE')
+        return hf_hub_download(repo_id=self.repo_id,
+                               filename=filename,
+                               cache_dir=cache,
+                               local_files_only=offline)
+
     def load(self) -> None:
         # Get model and tags paths
         if self.is_hf:
@@ -358,15 +548,136 @@ class WaifuDiffusionInterrogator(Interrogator):
 
         # Load based on model type
         if self.model_type == "onnx":
-            ort = get_onnxrt()
-            self.model = ort.InferenceSession(model_path,
-                                              providers=onnxrt_providers)
+            key = (str(model_path), tuple(
+                p if isinstance(p, str) else p[0] for p in onnxrt_providers
+            ))
+            self.model = _SESSION_CACHE.get(key)
+            if self.model is None:
+                ort = get_onnxrt()
+                sess_options = ort.SessionOptions()
+                sess_options.graph_optimization_level = \
+                    ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+                # models run side by side on their own workers, each gets
+                # its share of the cores rather than all of them
+                sess_options.intra_op_num_threads = max(
+                    1, (os.cpu_count() or 4) //
+                    max(1, int(utils.concurrent_models)))
+                cpu_only = key[1][0] != 'CUDAExecutionProvider' or \
+                    'CUDAExecutionProvider' not in ort.get_available_providers()
+                if cpu_only:
+                    # no arena on CPU: extending it for a larger batch shows
+                    # up as latency spikes, while plain allocations cost a
+                    # little on every run. Memory patterns only pay off for
+                    # fixed input shapes, and the batch size varies; with a
+                    # fixed batch size enable_mem_pattern is worth keeping.
+                    sess_options.enable_cpu_mem_arena = False
+                    sess_options.enable_mem_pattern = False
+                elif _register_env_allocator(ort):
+                    # allocate host memory from one arena shared by the
+                    # sessions
+                    sess_options.add_session_config_entry(
+                        'session.use_env_allocators', '1')
+                # upload uint8 pixels, a quarter of the float32 bytes
+                self.model = ort.InferenceSession(
+                    _uint8_input_model(model_path),
+                    sess_options=sess_options,
+                    providers=onnxrt_providers)
+                _SESSION_CACHE[key] = self.model
+            model_input = self.model.get_inputs()[0]
+            self._input_name = model_input.name
+            self._label_name = self.model.get_outputs()[0].name
+            self._uint8_input = model_input.type == 'tensor(uint8)'
+            # WD14 models output probabilities ("predictions_sigmoid"); for
+            # other models this is decided on the first run
+            self._apply_sigmoid = False \
+                if 'sigmoid' in self._label_name.lower() else None
+            # WD14 exports are NHWC, but accept NCHW models as well
+            self._nchw = model_input.shape[1] == 3
+            self._height = model_input.shape[2 if self._nchw else 1]
+            self._io_binding = None
+            self._ort_input = None
+            if 'CUDAExecutionProvider' in self.model.get_providers():
+                # keep input and output on the device between runs, the
+                # output is allocated by onnxruntime as the batch size varies
+                self._io_binding = self.model.io_binding()
+                self._io_binding.bind_output(self._label_name, 'cuda',
+                                             ONNX_DEVICE_ID)
         else:
             raise ValueError(f"Unsupported model type: {self.model_type}")
 
         print(f'Loaded {self.name} model from {model_path}')
 
-        self.tags = read_csv(tags_path)
+        # only the name and category columns are used
+        with open(tags_path, newline='', encoding='utf-8') as csv_file:
+            reader = csv.reader(csv_file)
+            header = next(reader)
+            name_col = header.index('name')
+            category_col = header.index('category') \
+                if 'category' in header else None
+            rows = list(reader)
+
+        # first 4 items are for rating (general, sensitive, questionable,
+        # explicit), rest are regular tags
+        self._tag_names = array([row[name_col] for row in rows], dtype=object)
+        self._rating_names = self._tag_names[:4].tolist()
+        self._general_names = self._tag_names[4:].tolist()
+        if category_col is not None:
+            self._general_categories = array(
+                [int(row[category_col]) for row in rows[4:]], dtype=int8)
+        else:
+            self._general_categories = None
+
+    def unload(self) -> bool:
+        self._io_binding = None
+        self._ort_input = None
+        return super().unload()
+
+    def shrink(self) -> bool:
+        # onnxruntime shrinks an arena only at the end of a run that asks
+        # for it, so run a one image batch; only the CUDA arena is shrunk,
+        # CPU-only sessions run without one
+        _TENSOR_POOL.clear()
+        if self.model is None or self._io_binding is None:
+            return False
+
+        from onnxruntime import RunOptions
+        run_options = RunOptions()
+        run_options.add_run_config_entry(
+            'memory.enable_memory_arena_shrinkage', f'gpu:{ONNX_DEVICE_ID}')
+        shape = (1, 3, self._height, self._height) if self._nchw \
+            else (1, self._height, self._height, 3)
+        dummy = zeros(shape, dtype=uint8 if self._uint8_input else float32)
+        # the device input buffer is dropped, to be reallocated on next use
+        self._ort_input = None
+        self._io_binding.clear_binding_inputs()
+        self.model.run([self._label_name], {self._input_name: dummy},
+                       run_options)
+        print(f'Shrunk {self.name} memory arena')
+        return True
+
+    def tag_categories(self):
+        return self._general_categories
+
+    def _run(self, batch):
+        """ run the model on a preprocessed batch, returns the confidences """
+        if self._io_binding is None:
+            return self.model.run([self._label_name],
+                                  {self._input_name: batch})[0]
+
+        # reuse the device input buffer while the batch shape is unchanged
+        if self._ort_input is None or \
+                self._ort_input.shape() != list(batch.shape):
+            from onnxruntime import OrtValue
+            self._ort_input = OrtValue.ortvalue_from_numpy(batch, 'cuda',
+                                                           ONNX_DEVICE_ID)
+            self._io_binding.bind_ortvalue_input(self._input_name,
+                                                 self._ort_input)
+        else:
+            self._ort_input.update_inplace(batch)
+
+        self.model.run_with_iobinding(self._io_binding)
+        return self._io_binding.copy_outputs_to_cpu()[0]
 
     def interrogate(
         self,
@@ -375,6 +686,15 @@ class WaifuDiffusionInterrogator(Interrogator):
         Dict[str, float],  # rating confidences
         Dict[str, float]  # tag confidences
     ]:
+        return self.interrogate_batch([image])[0]
+
+    def interrogate_batch(
+        self,
+        images: List[Image]
+    ) -> List[Tuple[
+        Dict[str, float],  # rating confidences
+        Dict[str, float]  # tag confidences
+    ]]:
         # init model
         if self.model is None:
             self.load()
@@ -383,41 +703,85 @@ class WaifuDiffusionInterrogator(Interrogator):
         if self.model_type != "onnx":
             raise ValueError(f"Unsupported model type: {self.model_type}")
 
-        # code for converting the image and running the model is taken from the
-        # link below. thanks, SmilingWolf!
-        # https://huggingface.co/spaces/SmilingWolf/wd-v1-4-tags/blob/main/app.py
-
-        # convert an image to fit the model
-        _, height, _, _ = self.model.get_inputs()[0].shape
-
-        # alpha to white
-        image = dbimutils.fill_transparent(image)
-
-        image = asarray(image)
-        # PIL RGB to OpenCV BGR
-        image = image[:, :, ::-1]
-
-        image = dbimutils.make_square(image, height)
-        image = dbimutils.smart_resize(image, height)
-        image = image.astype(float32)
-        image = expand_dims(image, 0)
-
-        # evaluate model
-        input_name = self.model.get_inputs()[0].name
-        label_name = self.model.get_outputs()[0].name
-        confidences = self.model.run([label_name], {input_name: image})[0]
-
-        tags = self.tags[:][['name']]
-        tags['confidences'] = confidences[0]
+        # evaluate model, once for the whole batch
+        return self._infer(self._prepare_batch(images))
 
-        # first 4 items are for rating (general, sensitive, questionable,
-        # explicit)
-        ratings = dict(tags[:4].values)
+    def interrogate_stream(
+        self,
+        images: Iterable,
+        batch_size: int = 16
+    ) -> Iterator[Tuple[
+        Dict[str, float],  # rating confidences
+        Dict[str, float]  # tag confidences
+    ]]:
+        """ interrogate in batches, preprocessing the next batches while the
+        model runs the current one; yields results in input order """
+        if self.model is None:
+            self.load()
 
-        # rest are regular tags
-        tags = dict(tags[4:].values)
+        if self.model_type != "onnx":
+            raise ValueError(f"Unsupported model type: {self.model_type}")
 
-        return ratings, tags
+        images = iter(images)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=2,
+                                thread_name_prefix='tagger-preproc') as pool:
+            try:
+                while True:
+                    chunk = list(islice(images, batch_size))
+                    if chunk:
+                        pending.append(pool.submit(self._prepare_batch,
+                                                   chunk))
+                    # keep one batch preprocessing ahead of the model
+                    if pending and (len(pending) > 1 or not chunk):
+                        yield from self._infer(pending.popleft().result())
+                    if not chunk and not pending:
+                        break
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _prepare_batch(self, images: List[Image]):
+        """ preprocess images into a model input """
+        # convert the images to fit the model, as one batch, in buffers
+        # reused across batches of the same size
+        height = self._height
+        batch = _TENSOR_POOL.acquire((len(images), height, height, 3),
+                                     uint8)
+        for i, image in enumerate(images):
+            _preproc.preprocess(image, height, out=batch[i])
+
+        # without the uint8 input model, cast on the host
+        if self._nchw or not self._uint8_input:
+            view = batch.transpose(0, 3, 1, 2) if self._nchw else batch
+            converted = _TENSOR_POOL.acquire(
+                view.shape, uint8 if self._uint8_input else float32)
+            copyto(converted, view, casting='unsafe')
+            _TENSOR_POOL.release(batch)
+            batch = converted
+        return batch
+
+    def _infer(self, batch) -> List[Tuple[Dict[str, float], Dict[str, float]]]:
+        """ run a prepared batch, returns ratings and tags per image; the
+        batch goes back to the pool """
+        try:
+            confidences = self._run(batch)
+        finally:
+            # the session copies its inputs, so the buffer is free again
+            _TENSOR_POOL.release(batch)
+
+        # probabilities never leave [0, 1], so anything else means logits
+        if self._apply_sigmoid is None:
+            self._apply_sigmoid = bool(confidences.min() < 0 or
+                                       confidences.max() > 1)
+        if self._apply_sigmoid:
+            confidences = 1.0 / (1.0 + exp(-confidences))
+
+        return [
+            (dict(zip(self._rating_names, conf[:4])),
+             dict(zip(self._general_names, conf[4:])))
+            for conf in confidences.tolist()
+        ]
 
     def dry_run(self, images) -> Tuple[str, Callable[[str], None]]:
 
@@ -2,7 +2,8 @@
 import os
 import json
 
-from typing import Tuple, List, Dict
+from collections import deque
+from typing import Tuple, List, Dict, Optional
 from pathlib import Path
 
 try:
@@ -17,17 +18,31 @@ try:
     HAS_SD = True
 except ImportError:
     HAS_SD = False
-    # Create a simple replacement function
+    # Create a simple replacement function; removes forbidden characters
+    _FORBIDDEN_TRANS = str.maketrans('', '', '"*/:<>?\\|+[]')
+
     def sanitize_filename_part(text, replace_spaces=True):
         if text is None:
             return ''
         if replace_spaces:
             text = text.replace(' ', '_')
-        # Remove forbidden characters
-        forbidden_chars = ['"', '*', '/', ':', '<', '>', '?', '\\', '|', '+', '[', ']']
-        for char in forbidden_chars:
-            text = text.replace(char, '')
-        return text
+        return text.translate(_FORBIDDEN_TRANS)
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+
+def _dumps(obj) -> bytes:
+    """ serialize a preset to bytes, orjson only indents by two """
+    if HAS_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=4).encode('utf-8')
+
+
+_loads = orjson.loads if HAS_ORJSON else json.loads
 
 PresetDict = Dict[str, Dict[str, any]]
 
@@ -38,6 +53,8 @@ class Preset:
     default_filename: str
     default_values: PresetDict
     components: List[object]
+    _list_cache: Optional[Tuple[int, List[str]]]
+    _load_cache: Dict[Path, Tuple[Tuple[int, int], PresetDict]]
 
     def __init__(
         self,
@@ -46,21 +63,23 @@ class Preset:
     ) -> None:
         self.base_dir = Path(base_dir)
         self.default_filename = default_filename
+        self._list_cache = None
+        self._load_cache = {}
         self.default_values = self.load(default_filename)[1]
         self.components = []
 
     def component(self, component_class: object, **kwargs) -> object:
         # find all the top components from the Gradio context and create a path
         parent = Context.block if HAS_GRADIO else None
-        paths = []
-        
+        paths = deque()
+
         # Get label if available
         if 'label' in kwargs:
             paths.append(kwargs['label'])
 
         while parent is not None:
             if hasattr(parent, 'label'):
-                paths.insert(0, parent.label)
+                paths.appendleft(parent.label)
 
             parent = parent.parent if hasattr(parent, 'parent') else None
 
@@ -91,18 +110,27 @@ class Preset:
             filename += '.json'
 
         path = self.base_dir.joinpath(sanitize_filename_part(filename))
-        configs = {}
-
-        if path.is_file():
-            configs = json.loads(path.read_text(encoding='utf-8'))
-
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return path, {}
+
+        # the parsed presets are shared, callers must not modify them
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._load_cache.get(path)
+        if cached is not None and cached[0] == key:
+            return path, cached[1]
+
+        configs = _loads(path.read_bytes()) if path.is_file() else {}
+        self._load_cache[path] = (key, configs)
         return path, configs
 
     def save(self, filename: str, *values) -> Tuple:
         path, configs = self.load(filename)
+        configs = dict(configs)
 
         for index, component in enumerate(self.components):
-            config = configs.get(component.path, {})
+            config = dict(configs.get(component.path, {}))
             config['value'] = values[index] if index < len(values) else None
 
             for attr in ['visible', 'min', 'max', 'step']:
@@ -112,7 +140,7 @@ class Preset:
             configs[component.path] = config
 
         self.base_dir.mkdir(0o777, True, True)
-        path.write_text(json.dumps(configs, indent=4), encoding='utf-8')
+        path.write_bytes(_dumps(configs))
 
         return 'successfully saved the preset'
 
@@ -125,7 +153,7 @@ class Preset:
 
             if 'value' in config and hasattr(component, 'choices'):
                 if hasattr(component, 'choices') and config['value'] not in component.choices:
-                    config['value'] = None
+                    config = {**config, 'value': None}
 
             # In standalone mode, just return the value
             if not HAS_GRADIO:
@@ -136,13 +164,24 @@ class Preset:
         return (*outputs, 'successfully loaded the preset')
 
     def list(self) -> List[str]:
-        presets = [
-            p.name
-            for p in self.base_dir.glob('*.json')
-            if p.is_file()
-        ]
+        try:
+            mtime = self.base_dir.stat().st_mtime_ns
+        except FileNotFoundError:
+            return [self.default_filename]
+
+        # the directory mtime changes whenever a preset is added or removed
+        if self._list_cache is not None and self._list_cache[0] == mtime:
+            return list(self._list_cache[1])
+
+        with os.scandir(self.base_dir) as entries:
+            presets = [
+                entry.name
+                for entry in entries
+                if entry.name.endswith('.json') and entry.is_file()
+            ]
 
         if len(presets) < 1:
             presets.append(self.default_filename)
 
-        return presets
\ No newline at end of file
+        self._list_cache = (mtime, presets)
+        return list(presets)
\ No newline at end of file
@@ -39,7 +39,7 @@ def unload_interrogators() -> Tuple[str]:
     unloaded_models = 0
     remaining_models = ''
 
-    for i in utils.interrogators.values():
+    for i in utils.interrogators.loaded():
         if i.unload():
             unloaded_models = unloaded_models + 1
         elif i.model is not None:
@@ -50,6 +50,8 @@ def unload_interrogators() -> Tuple[str]:
     if remaining_models != '':
         remaining_models = remaining_models + "Some tensorflow models could "\
                            "not be unloaded, a known issue."
+    # unload keeps the onnx sessions cached, drop them to free the memory
+    It.purge_sessions()
     QData.clear(1)
 
     return (f'{unloaded_models} model(s) unloaded{remaining_models}',)
@@ -73,10 +75,10 @@ def on_interrogate(
             getattr(QData, "update_" + part)(val)
             It.input[part] = val
 
-    interrogator: It = next((i for i in utils.interrogators.values() if
-                             i.name == name), None)
-    if interrogator is None:
+    key = utils.interrogator_keys().get(name)
+    if key is None:
         return (None,) * 6 + (f"'{name}': invalid interrogator",)
+    interrogator: It = utils.interrogators[key]
 
     interrogator.batch_interrogate()
     return search_filter(filt)
@@ -105,10 +107,10 @@ def on_interrogate_image_submit(
 
     if image is None:
         return (None,) * 6 + ('No image selected',)
-    interrogator: It = next((i for i in utils.interrogators.values() if
-                             i.name == name), None)
-    if interrogator is None:
+    key = utils.interrogator_keys().get(name)
+    if key is None:
         return (None,) * 6 + (f"'{name}': invalid interrogator",)
+    interrogator: It = utils.interrogators[key]
 
     interrogator.interrogate_image(image)
     return search_filter(filt)
@@ -260,8 +262,7 @@ def on_ui_tabs():
                     with gr.Row(variant='compact'):
                         def refresh():
                             utils.refresh_interrogators()
-                            return sorted(x.name for x in utils.interrogators
-                                                               .values())
+                            return sorted(utils.interrogator_keys())
                         interrogator_names = refresh()
                         interrogator = utils.preset.component(
                             gr.Dropdown,
@@ -1,7 +1,9 @@
 """Utility functions for the tagger module"""
 import os
 
-from typing import List, Dict
+from collections.abc import MutableMapping
+from functools import partial
+from typing import List, Dict, Callable, Iterator, Tuple, TYPE_CHECKING
 from pathlib import Path
 
 # Standalone mode settings
@@ -14,62 +16,159 @@ HAS_SD = False
 default_ddp_path = Path(shared.models_path, 'deepdanbooru')
 default_onnx_path = Path(shared.models_path, 'TaggerOnnx')
 
-from tagger.preset import Preset  # pylint: disable=import-error
-from tagger.interrogator import Interrogator, DeepDanbooruInterrogator, \
-                                WaifuDiffusionInterrogator  # pylint: disable=E0401 # noqa: E501
-
-# Simplified preset handling for standalone mode
-preset = Preset(Path('presets'))
-
-interrogators: Dict[str, Interrogator] = {
-    'wd14-vit.v1': WaifuDiffusionInterrogator(
-        'WD14 ViT v1',
-        repo_id='SmilingWolf/wd-v1-4-vit-tagger'
-    ),
-    'wd14-vit.v2': WaifuDiffusionInterrogator(
-        'WD14 ViT v2',
-        repo_id='SmilingWolf/wd-v1-4-vit-tagger-v2',
-    ),
-    'wd14-convnext.v1': WaifuDiffusionInterrogator(
-        'WD14 ConvNeXT v1',
-        repo_id='SmilingWolf/wd-v1-4-convnext-tagger'
-    ),
-    'wd14-convnext.v2': WaifuDiffusionInterrogator(
-        'WD14 ConvNeXT v2',
-        repo_id='SmilingWolf/wd-v1-4-convnext-tagger-v2',
-    ),
-    'wd14-convnextv2.v1': WaifuDiffusionInterrogator(
-        'WD14 ConvNeXTV2 v1',
-        # the name is misleading, but it's v1
-        repo_id='SmilingWolf/wd-v1-4-convnextv2-tagger-v2',
-    ),
-    'wd14-swinv2-v1': WaifuDiffusionInterrogator(
-        'WD14 SwinV2 v1',
-        # again misleading name
-        repo_id='SmilingWolf/wd-v1-4-swinv2-tagger-v2',
-    ),
-    'wd-v1-4-moat-tagger.v2': WaifuDiffusionInterrogator(
-        'WD14 moat tagger v2',
-        repo_id='SmilingWolf/wd-v1-4-moat-tagger-v2'
-    ),
+if TYPE_CHECKING:
+    from tagger.interrogator import Interrogator  # pylint: disable=E0401
+
+
+def __getattr__(name: str):
+    """ the preset is only created, and tagger.preset imported, when it is
+    first used """
+    if name == 'preset':
+        from tagger.preset import Preset  # pylint: disable=import-error
+        global preset  # pylint: disable=global-variable-undefined
+        # Simplified preset handling for standalone mode
+        preset = Preset(Path('presets'))
+        return preset
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def _waifu_diffusion(name: str, repo_id: str) -> 'Interrogator':
+    """ factory of the built-in models, importing tagger.interrogator on
+    the first model that is used """
+    from tagger.interrogator import \
+        WaifuDiffusionInterrogator  # pylint: disable=import-error
+    return WaifuDiffusionInterrogator(name, repo_id=repo_id)
+
+
+class _LazyDict(MutableMapping):
+    """ interrogators by name, built from their factory on first access """
+    def __init__(self, factories: Dict[str, Callable[[], 'Interrogator']]):
+        self._data = dict(factories)
+        self._pending = set(factories)
+
+    def __getitem__(self, key: str) -> 'Interrogator':
+        value = self._data[key]
+        if key in self._pending:
+            value = self._data[key] = value()
+            self._pending.discard(key)
+        return value
+
+    def __setitem__(self, key: str, value: 'Interrogator') -> None:
+        self._data[key] = value
+        self._pending.discard(key)
+
+    def __delitem__(self, key: str) -> None:
+        del self._data[key]
+        self._pending.discard(key)
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def loaded(self) -> List['Interrogator']:
+        """ the interrogators built so far, without building the rest """
+        return [v for _, v in self.loaded_items()]
+
+    def loaded_items(self) -> List[Tuple[str, 'Interrogator']]:
+        """ (key, interrogator) of the ones built so far """
+        return [(k, v) for k, v in self._data.items()
+                if k not in self._pending]
+
+
+# (key, display name, Hugging Face repo) of the built-in models
+_WD_SPECS: Tuple[Tuple[str, str, str], ...] = (
+    ('wd14-vit.v1', 'WD14 ViT v1', 'SmilingWolf/wd-v1-4-vit-tagger'),
+    ('wd14-vit.v2', 'WD14 ViT v2', 'SmilingWolf/wd-v1-4-vit-tagger-v2'),
+    ('wd14-convnext.v1', 'WD14 ConvNeXT v1',
+     'SmilingWolf/wd-v1-4-convnext-tagger'),
+    ('wd14-convnext.v2', 'WD14 ConvNeXT v2',
+     'SmilingWolf/wd-v1-4-convnext-tagger-v2'),
+    # the name is misleading, but it's v1
+    ('wd14-convnextv2.v1', 'WD14 ConvNeXTV2 v1',
+     'SmilingWolf/wd-v1-4-convnextv2-tagger-v2'),
+    # again misleading name
+    ('wd14-swinv2-v1', 'WD14 SwinV2 v1',
+     'SmilingWolf/wd-v1-4-swinv2-tagger-v2'),
+    ('wd-v1-4-moat-tagger.v2', 'WD14 moat tagger v2',
+     'SmilingWolf/wd-v1-4-moat-tagger-v2'),
+)
+
+_FACTORIES: Dict[str, Callable[[], 'Interrogator']] = {
+    key: partial(_waifu_diffusion, name, repo_id)
+    for key, name, repo_id in _WD_SPECS
 }
 
+# models are only instantiated when they are first looked up
+interrogators = _LazyDict(_FACTORIES)
+
+# models served side by side, set by the host application before the first
+# model loads
+concurrent_models = 1
+
+
+def interrogator_keys() -> Dict[str, str]:
+    """ key of each interrogator by its display name, without building the
+    ones that were not used yet """
+    keys = {name: key for key, name, _ in _WD_SPECS if key in interrogators}
+    keys.update((i.name, key) for key, i in interrogators.loaded_items())
+    return keys
+
+
+def _tag_select_key(entry: os.DirEntry) -> int:
+    """ csv files named like selected_tags.csv first """
+    name = entry.name.lower()
+    return ('tag' not in name) + ('select' not in name)
+
+
+def _dir_key(root) -> Tuple[Tuple[str, int], ...]:
+    """ name and mtime of each entry of a model root; a file added to or
+    removed from a model directory changes that directory's mtime """
+    key = []
+    with os.scandir(root) as entries:
+        for entry in entries:
+            try:
+                key.append((entry.name, entry.stat().st_mtime_ns))
+            except OSError:
+                # e.g. a dangling symlink, skipped by the scan as well
+                key.append((entry.name, -1))
+    key.sort()
+    return tuple(key)
+
+
+# (ddp root, onnx root) -> (entry mtimes, sorted model names) of the last scan
+_refresh_cache: Dict[Tuple[str, str], Tuple[tuple, Tuple[str, ...]]] = {}
+
 
 def refresh_interrogators() -> List[str]:
     """Refreshes the interrogators list"""
+    from tagger.interrogator import DeepDanbooruInterrogator, \
+        WaifuDiffusionInterrogator  # pylint: disable=import-error
+
     # load deepdanbooru project
     ddp_path = os.environ.get('DEEPDANBOORU_PROJECTS_PATH', default_ddp_path)
     onnx_path = os.environ.get('ONNXTAGGER_PATH', default_onnx_path)
     os.makedirs(ddp_path, exist_ok=True)
     os.makedirs(onnx_path, exist_ok=True)
 
+    # rescan only when a model directory, or the files in one, changed
+    key = (_dir_key(ddp_path), _dir_key(onnx_path))
+    roots = (str(ddp_path), str(onnx_path))
+    cached = _refresh_cache.get(roots)
+    if cached is not None and cached[0] == key:
+        return list(cached[1])
+
     for path in os.scandir(ddp_path):
         print(f"Scanning {path} as deepdanbooru project")
         if not path.is_dir():
             print(f"Warning: {path} is not a directory, skipped")
             continue
 
-        if not Path(path, 'project.json').is_file():
+        if not os.path.isfile(os.path.join(path.path, 'project.json')):
             print(f"Warning: {path} has no project.json, skipped")
             continue
 
@@ -81,25 +180,29 @@ def refresh_interrogators() -> List[str]:
             print(f"Warning: {path} is not a directory, skipped")
             continue
 
-        # Check for ONNX model files
-        onnx_files = [x for x in os.scandir(path) if x.name.endswith('.onnx')]
-        
+        # Check for ONNX model and tag files, in one pass over the directory;
+        # the uint8 input models written next to the model are not counted
+        onnx_files, csv = [], []
+        with os.scandir(path) as entries:
+            for x in entries:
+                name = x.name
+                if name.endswith('.onnx'):
+                    if not name.endswith('.uint8in.onnx'):
+                        onnx_files.append(x)
+                elif name.endswith('.csv'):
+                    csv.append(x)
+
         if len(onnx_files) != 1:
             print(f"Warning: {path} requires exactly one .onnx model, skipped")
             continue
             
-        local_model_path = Path(path, onnx_files[0].name)
+        local_model_path = os.path.join(path.path, onnx_files[0].name)
 
-        csv = [x for x in os.scandir(path) if x.name.endswith('.csv')]
         if len(csv) == 0:
             print(f"Warning: {path} has no selected tags .csv file, skipped")
             continue
 
-        def tag_select_csvs_up_front(k):
-            return sum(-1 if t in k.name.lower() else 1 for t in ["tag", "select"])
-
-        csv.sort(key=tag_select_csvs_up_front)
-        tags_path = Path(path, csv[0])
+        tags_path = min(csv, key=_tag_select_key).path
 
         if path.name not in interrogators:
             # Create new interrogator for local ONNX model
@@ -109,11 +212,13 @@ def refresh_interrogators() -> List[str]:
                 is_hf=False
             )
 
-        interrogators[path.name].local_model = str(local_model_path)
-        interrogators[path.name].local_tags = str(tags_path)
+        interrogators[path.name].local_model = local_model_path
+        interrogators[path.name].local_tags = tags_path
         interrogators[path.name].model_type = "onnx"  # Store model type
 
-    return sorted(interrogators.keys())
+    names = tuple(sorted(interrogators.keys()))
+    _refresh_cache[roots] = (key, names)
+    return list(names)
 
 
 def split_str(string: str, separator=',') -> List[str]:
@@ -1,12 +1,16 @@
+import os
+
 import onnxruntime as ort
 import numpy as np
 
 print("Available providers:", ort.get_available_providers())
 
+model_bytes = None
+sess_options = None
+
 # Test if CUDA provider works by creating a simple model
 try:
     # Create a simple ONNX model for testing with compatible opset version
-    import onnx
     from onnx import helper, TensorProto, OperatorSetIdProto
     
     # Define a simple model that adds two inputs
@@ -25,34 +29,57 @@ try:
     model_def = helper.make_model(graph_def, producer_name='test', opset_imports=opset_import)
     model_def.ir_version = 8
     
-    # Save the model
-    onnx.save(model_def, 'test_model.onnx')
+    # Keep the model in memory, no need for a file
+    model_bytes = model_def.SerializeToString()
     
+    # Same session settings as the tagger: bounded intra-op threads and
+    # host memory from an allocator shared through the environment
+    sess_options = ort.SessionOptions()
+    sess_options.intra_op_num_threads = os.cpu_count() or 4
+    sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    try:
+        ort.create_and_register_allocator(
+            ort.OrtMemoryInfo("Cpu", ort.OrtAllocatorType.ORT_ARENA_ALLOCATOR,
+                              0, ort.OrtMemType.DEFAULT),
+            ort.OrtArenaCfg(0, -1, -1, -1))
+        sess_options.add_session_config_entry("session.use_env_allocators", "1")
+    except Exception as e:
+        print("Shared allocator not available:", str(e))
+
     # Try to create inference session with CUDA provider
-    session = ort.InferenceSession('test_model.onnx', providers=['CUDAExecutionProvider'])
+    session = ort.InferenceSession(model_bytes, sess_options=sess_options, providers=[
+        ('CUDAExecutionProvider', {
+            'arena_extend_strategy': 'kSameAsRequested',
+            'cudnn_conv_algo_search': 'HEURISTIC',
+        }),
+    ])
     print("CUDA Execution Provider works!")
     
     # Test inference
-    x1 = np.random.random((1, 3, 224, 224)).astype(np.float32)
-    x2 = np.random.random((1, 3, 224, 224)).astype(np.float32)
+    rng = np.random.default_rng()
+    x1 = rng.random((1, 3, 224, 224), dtype=np.float32)
+    x2 = rng.random((1, 3, 224, 224), dtype=np.float32)
     
-    result = session.run(None, {'X1': x1, 'X2': x2})
+    # bind inputs and output on the device, so the run itself does no
+    # host copies and the CUDA memory path is exercised as well
+    io_binding = session.io_binding()
+    x1_ort = ort.OrtValue.ortvalue_from_numpy(x1, 'cuda', 0)
+    x2_ort = ort.OrtValue.ortvalue_from_numpy(x2, 'cuda', 0)
+    io_binding.bind_ortvalue_input('X1', x1_ort)
+    io_binding.bind_ortvalue_input('X2', x2_ort)
+    io_binding.bind_output('Y', 'cuda')
+    session.run_with_iobinding(io_binding)
+    result = io_binding.copy_outputs_to_cpu()[0]
     print("Inference successful with CUDA!")
     
-    # Clean up
-    import os
-    os.remove('test_model.onnx')
-    
 except Exception as e:
     print("Error with CUDA provider:", str(e))
     
     # Try with CPU provider as fallback
     try:
-        session = ort.InferenceSession('test_model.onnx', providers=['CPUExecutionProvider'])
+        session = ort.InferenceSession(model_bytes, sess_options=sess_options,
+                                       providers=['CPUExecutionProvider'])
         print("CPU Execution Provider works as fallback")
-        os.remove('test_model.onnx')
     except Exception as e2:
-        print("Error with CPU provider:", str(e2))
-        if 'test_model.onnx' in locals():
-            import os
-            os.remove('test_model.onnx')
\ No newline at end of file
+        print("Error with CPU provider:", str(e2))
\ No newline at end of file
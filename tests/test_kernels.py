@@ -0,0 +1,44 @@
+"""The tag filtering kernel against a NumPy reference"""
+import numpy as np
+import pytest
+
+from tagger import _kernels
+
+
+def _reference(scores, categories, threshold):
+    above = scores > threshold
+    chars = [i for i in range(len(scores)) if above[i] and categories[i] == 4]
+    tags = [i for i in range(len(scores)) if above[i] and categories[i] != 4]
+    return np.array(chars, dtype=np.int64), np.array(tags, dtype=np.int64)
+
+
+@pytest.mark.parametrize('size', [0, 1, 17, 9083])
+@pytest.mark.parametrize('threshold', [0.0, 0.35, 0.85, 1.0])
+def test_filter_and_split_matches_reference(size, threshold):
+    rng = np.random.default_rng(size)
+    scores = rng.random(size)
+    categories = rng.choice(np.array([0, 4, 9], dtype=np.int8), size)
+
+    chars, tags = _kernels.filter_and_split(scores, categories, threshold)
+    expected_chars, expected_tags = _reference(scores, categories, threshold)
+
+    np.testing.assert_array_equal(chars, expected_chars)
+    np.testing.assert_array_equal(tags, expected_tags)
+
+
+def test_filter_and_split_excludes_threshold():
+    scores = np.array([0.5, 0.5, 0.6, 0.4])
+    categories = np.array([4, 0, 4, 0], dtype=np.int8)
+    chars, tags = _kernels.filter_and_split(scores, categories, 0.5)
+    assert chars.tolist() == [2]
+    assert tags.tolist() == []
+
+
+def test_numpy_fallback_matches_reference():
+    rng = np.random.default_rng(0)
+    scores = rng.random(500)
+    categories = rng.choice(np.array([0, 4, 9], dtype=np.int8), 500)
+    for got, expected in zip(
+            _kernels._filter_and_split_numpy(scores, categories, 0.35),
+            _reference(scores, categories, 0.35)):
+        np.testing.assert_array_equal(got, expected)
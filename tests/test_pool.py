@@ -0,0 +1,30 @@
+"""The batch buffer pool stays within its byte budget"""
+import numpy as np
+
+from tagger._pool import TensorPool
+
+
+def test_reuses_released_arrays():
+    pool = TensorPool()
+    array = pool.acquire((2, 3), np.float32)
+    pool.release(array)
+    assert pool.acquire((2, 3), np.float32) is array
+    assert pool.nbytes == 0
+
+
+def test_evicts_least_recently_used_shapes():
+    pool = TensorPool(max_bytes=3000)
+    arrays = [np.empty((n, 100), dtype=np.uint8) for n in range(1, 17)]
+    for array in arrays:
+        pool.release(array)
+
+    assert pool.nbytes <= 3000
+    # the last sizes released are the ones kept
+    assert pool.acquire((16, 100), np.uint8) is arrays[-1]
+    assert pool.acquire((1, 100), np.uint8) is not arrays[0]
+
+
+def test_skips_arrays_over_the_budget():
+    pool = TensorPool(max_bytes=100)
+    pool.release(np.empty(200, dtype=np.uint8))
+    assert pool.nbytes == 0
@@ -0,0 +1,43 @@
+"""The fused preprocessing kernel against the NumPy/OpenCV reference"""
+import numpy as np
+import pytest
+from PIL import Image
+
+from tagger import _preproc
+
+pytestmark = pytest.mark.skipif(not _preproc.HAS_NUMBA,
+                                reason='numba is not installed')
+
+
+def _image(mode: str, width: int, height: int) -> Image.Image:
+    rng = np.random.default_rng(width * 1000 + height)
+    rgba = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    image = Image.fromarray(rgba, 'RGBA')
+    if mode == 'P':
+        return image.convert('RGB').convert('P')
+    return image.convert(mode)
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA', 'L', 'P'])
+@pytest.mark.parametrize('width, height', [
+    (64, 64),     # upscale
+    (40, 90),     # upscale, padded
+    (448, 448),   # same size
+    (900, 600),   # downscale, padded
+    (513, 1031),  # downscale, not a multiple of the target
+])
+def test_fused_matches_numpy(mode, width, height):
+    image = _image(mode, width, height)
+    fused = _preproc.preprocess(image, 448)
+    reference = _preproc._preprocess_numpy(image, 448)
+
+    assert fused.shape == reference.shape == (448, 448, 3)
+    assert fused.dtype == np.uint8
+    diff = np.abs(fused.astype(np.int16) - reference.astype(np.int16))
+    assert diff.max() <= 1
+
+
+def test_preprocess_writes_into_out():
+    image = _image('RGB', 300, 200)
+    out = np.empty((448, 448, 3), dtype=np.uint8)
+    assert _preproc.preprocess(image, 448, out=out) is out
@@ -4,43 +4,37 @@ Standalone executable for WD14 Tagger API
 This is a simplified version that only works as a standalone application
 """
 
+import importlib.abc
+import importlib.util
 import os
 import sys
-from pathlib import Path
+import types
 
 # Add current directory to Python path so we can import tagger modules
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+
 # Mock modules that might not be available in standalone mode
-try:
-    import safehttpx
-except ImportError:
-    import types
-    safehttpx = types.ModuleType('safehttpx')
-    safehttpx.__version__ = "1.0.0"
-    sys.modules['safehttpx'] = safehttpx
+class _SafehttpxStub(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    """ stub for safehttpx, which might not be available in standalone
+    mode; last on the meta path, so it is only used when the import would
+    fail otherwise """
+    def find_spec(self, fullname, path, target=None):
+        if fullname == 'safehttpx':
+            return importlib.util.spec_from_loader(fullname, self)
+        return None
+
+    def create_module(self, spec):
+        module = types.ModuleType(spec.name)
+        module.__version__ = "1.0.0"
+        return module
 
-# Initialize PIL
-try:
-    from PIL import Image, ImageFile
-    Image.init()
-    ImageFile.LOAD_TRUNCATED_IMAGES = True
-except ImportError:
-    print("Warning: PIL/Pillow not available")
+    def exec_module(self, module):
+        pass
 
-# Create FastAPI app
-try:
-    from fastapi import FastAPI
-    from fastapi.responses import JSONResponse, HTMLResponse
-    from fastapi.staticfiles import StaticFiles
-    app = FastAPI(title="WD14 Tagger API", version="1.0.0")
-except ImportError as e:
-    print(f"Error importing FastAPI: {e}")
-    sys.exit(1)
 
-# Serve static files
-static_dir = Path(__file__).parent / "static"
-static_dir.mkdir(exist_ok=True)
+sys.meta_path.append(_SafehttpxStub())
+
 
 def main():
     """
@@ -49,12 +43,21 @@ def main():
     """
     print("Starting WD14 Tagger Server...")
     print()
-    
-    # Import uvicorn here to ensure all mocks are in place
+
+    # Initialize PIL, a no-op once the plugins are loaded
+    try:
+        from PIL import Image, ImageFile
+        Image.init()
+        ImageFile.LOAD_TRUNCATED_IMAGES = True
+    except ImportError:
+        print("Warning: PIL/Pillow not available")
+
+    # Import FastAPI and uvicorn here to ensure all mocks are in place
     try:
+        import fastapi  # noqa: F401 # pylint: disable=unused-import
         import uvicorn
     except ImportError as e:
-        print(f"Error importing uvicorn: {e}")
+        print(f"Error importing FastAPI/uvicorn: {e}")
         print("Please make sure you have installed all required dependencies")
         print("Make sure you have installed the required packages:")
         print("  pip install fastapi uvicorn pillow pydantic")
@@ -69,8 +72,9 @@ def main():
     # Import standalone module components
     try:
         import standalone
-        # Mount the standalone app to preserve middleware, routes, and state
-        app.mount("/", standalone.app)
+        # serve the standalone app itself, a wrapper app would route every
+        # request twice; it also creates the static dir
+        app = standalone.app
     except ImportError:
         print("Error: Could not import standalone module")
         return 1
@@ -87,14 +91,8 @@ def main():
         print(f"Warning: Error loading models: {e}")
     
     # Run the API with default parameters from run_server.bat
-    print(f"Starting WD14 Tagger API on http://{host}:{port}")
-    print("Available endpoints:")
-    print("  GET  / - API documentation and usage examples")
-    print("  GET  /ui - Web interface for image tagging")
-    print("  POST /tagger/v1/interrogate - Interrogate an image")
-    print("  POST /tagger/v1/interrogate-categorized - Interrogate an image with categorized tags")
-    print("  GET  /tagger/v1/interrogators - List available models")
-    print("  POST /tagger/v1/unload-interrogators - Unload models from memory")
+    sys.stdout.write(standalone.BANNER.format(host=host, port=port))
+    sys.stdout.flush()
     
     try:
         # Run the server